@@ -19,7 +19,10 @@ setup(name='tap-braintree',
               'pylint',
               'ipdb',
               'nose',
-          ]
+          ],
+          'parquet': [
+              'pyarrow',
+          ],
       },
       entry_points='''
           [console_scripts]
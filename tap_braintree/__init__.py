@@ -2,24 +2,26 @@
 
 import json
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import os
 import pytz
 
 
 import braintree
-import backoff
 import singer
 
-from singer import utils
+from singer import utils, metadata
 from tap_braintree.discover import discover
 from .transform import transform_row
+from .export import ParquetExporter, DEFAULT_BATCH_SIZE
+from .trace import TRACER, now_us as trace_now_us
+from .retry import retry_api_errors
+from . import graphql
+from .state import StateEmitter
 
 from braintree.exceptions.authentication_error import AuthenticationError
-from braintree.exceptions.too_many_requests_error import TooManyRequestsError
-from braintree.exceptions.server_error import ServerError
-from braintree.exceptions.service_unavailable_error import ServiceUnavailableError
-from braintree.exceptions.gateway_timeout_error import GatewayTimeoutError
 
 
 REQUEST_TIMEOUT = 300
@@ -28,6 +30,9 @@ CONFIG = {}
 STATE = {}
 TRAILING_DAYS = timedelta(days=30)
 DEFAULT_TIMESTAMP = "1970-01-01T00:00:00Z"
+RESUME_KEY = "transactions_resume"
+REPAIR_BATCH_SIZE = 1000
+REPAIR_CONCURRENCY = 4
 
 logger = singer.get_logger()
 
@@ -47,10 +52,80 @@ def get_start(entity):
     return STATE[entity]
 
 
+def get_deadline():
+    """
+    Return the monotonic clock time by which the sync must stop, or None when
+    no `max_run_seconds` budget is configured.
+    """
+    max_run_seconds = CONFIG.get("max_run_seconds")
+    if not max_run_seconds:
+        return None
+    return time.monotonic() + max_run_seconds
+
+
 def to_utc(dt):
     return dt.replace(tzinfo=pytz.UTC)
 
 
+def get_disbursement_date(row):
+    """
+    Return the disbursement date of a transaction as a UTC datetime.
+
+    If disbursement is successful, get disbursement date; set disbursement
+    datetime to min if not found.
+    """
+    if row.disbursement_details is None:
+        return to_utc(datetime.min)
+
+    if row.disbursement_details.disbursement_date is None:
+        row.disbursement_details.disbursement_date = datetime.min
+
+    return to_utc(datetime.combine(
+        row.disbursement_details.disbursement_date,
+        datetime.min.time()))
+
+
+class Watermarks:
+    """
+    High water marks of updated_at and disbursement_date.
+
+    `latest_*` are the bookmarks stored by the previous run, `max_*` the
+    highest values written in this run.
+    """
+
+    def __init__(self, latest_updated_at, latest_disbursement_date):
+        self.latest_updated_at = latest_updated_at
+        self.latest_disbursement_date = latest_disbursement_date
+        self.max_updated_at = latest_updated_at
+        self.max_disbursement_date = latest_disbursement_date
+
+    def update(self, updated_at, disbursement_date):
+        """
+        Return True when a transaction should be written, tracking its values
+        in this run's high water marks.
+        """
+        # Is this more recent than our past stored value of update_at?
+        # Is this more recent than our past stored value of disbursement_date?
+        # Use >= for updated_at due to non monotonic updated_at values
+        # Use > for disbursement_date - confirming all transactions disbursed
+        # at the same time
+        # Update our high water mark for updated_at and disbursement_date
+        # in this run
+        if (
+            updated_at >= self.latest_updated_at
+        ) or (
+            disbursement_date >= self.latest_disbursement_date
+        ):
+
+            self.max_updated_at = max(self.max_updated_at, updated_at)
+
+            self.max_disbursement_date = max(self.max_disbursement_date, disbursement_date)
+
+            return True
+
+        return False
+
+
 def daterange(start_date, end_date):
     """
     Generator function that produces an iterable list of days between the two
@@ -85,44 +160,189 @@ def daterange(start_date, end_date):
         yield start_date + timedelta(n), start_date + timedelta(n + 1)
 
 
-@backoff.on_exception(
-    backoff.expo,
-    (
-        ConnectionError,
-        TooManyRequestsError,
-        ServerError,
-        ServiceUnavailableError,
-        GatewayTimeoutError,
-    ),
-    max_tries=5,
-    factor=2,
-)
+@retry_api_errors
 def get_transactions_data(start, end):
-    return braintree.Transaction.search(
-        braintree.TransactionSearch.created_at.between(start, end)
-    )
+    with TRACER.span("search", cat="api", start=str(start), end=str(end)):
+        return braintree.Transaction.search(
+            braintree.TransactionSearch.created_at.between(start, end)
+        )
+
+
+@retry_api_errors
+def get_transactions_by_ids(ids):
+    """
+    Search for a batch of transactions by ID and return them all, fetching
+    every result page.
+    """
+    with TRACER.span("search_ids", cat="api", count=len(ids)):
+        return list(braintree.Transaction.search(
+            braintree.TransactionSearch.ids.in_list(ids)
+        ))
+
+
+def read_transaction_ids(path):
+    """
+    Read one transaction ID per line from `path`, skipping blank lines and
+    duplicates while keeping the file order.
+    """
+    with open(path) as ids_file:
+        ids = (line.strip() for line in ids_file)
+        return list(dict.fromkeys(transaction_id for transaction_id in ids if transaction_id))
 
 
-def sync_transactions():
+def sync_transactions_by_ids():
+    """
+    Repair sync: fetch the transactions listed in the `repair_ids_path` file
+    with batched ID searches, run concurrently, and emit them through the
+    normal transform path. Bookmarks are neither read nor written.
+    """
     schema = load_schema("transactions")
 
     singer.write_schema("transactions", schema, ["id"],
                         bookmark_properties=['created_at'])
 
-    latest_updated_at = utils.strptime_to_utc(STATE.get('latest_updated_at', DEFAULT_TIMESTAMP))
+    ids = read_transaction_ids(CONFIG["repair_ids_path"])
+    batch_size = CONFIG.get("repair_batch_size", REPAIR_BATCH_SIZE)
+    concurrency = CONFIG.get("repair_concurrency", REPAIR_CONCURRENCY)
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+    logger.info("transactions: Repairing {} transactions in {} batches".format(
+        len(ids), len(batches)
+    ))
+
+    seen = set()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(get_transactions_by_ids, batch) for batch in batches]
+
+        for future in as_completed(futures):
+            time_extracted = utils.now()
+
+            for row in future.result():
+                if row.id in seen:
+                    continue
+                seen.add(row.id)
+
+                # Ensure updated_at consistency
+                if not getattr(row, 'updated_at'):
+                    row.updated_at = row.created_at
 
-    run_maximum_updated_at = latest_updated_at
+                singer.write_record("transactions", transform_row(row, schema),
+                                    time_extracted=time_extracted)
+
+    missing = len(ids) - len(seen)
+    logger.info("transactions: Repaired {} transactions, {} not found".format(
+        len(seen), missing
+    ))
+
+
+def get_graphql_client():
+    url = CONFIG.get("graphql_url") or graphql.URLS[CONFIG.get("environment", "Production")]
+
+    return graphql.GraphQLClient(
+        url, CONFIG["public_key"], CONFIG["private_key"],
+        timeout=CONFIG.get("request_timeout", REQUEST_TIMEOUT),
+        page_size=CONFIG.get("graphql_page_size", graphql.DEFAULT_PAGE_SIZE))
+
+
+def get_selected_fields(catalog):
+    """
+    Return the transactions properties selected in the catalog, or None when
+    the catalog does not select properties explicitly.
+    """
+    stream = catalog.get_stream("transactions") if catalog else None
+    if stream is None:
+        return None
+
+    mdata = metadata.to_map(stream.metadata)
+    properties = {breadcrumb[-1]: field_metadata
+                  for breadcrumb, field_metadata in mdata.items() if breadcrumb}
+
+    if not any("selected" in field_metadata for field_metadata in properties.values()):
+        return None
+
+    return [field for field, field_metadata in properties.items()
+            if field_metadata.get("selected") or field_metadata.get("inclusion") == "automatic"]
+
+
+def sync_transactions(selected_fields=None):
+    schema = load_schema("transactions")
+
+    exporter = None
+    if CONFIG.get("export_format") == "parquet":
+        exporter = ParquetExporter(
+            "transactions", schema, CONFIG["export_path"], "created_at",
+            batch_size=CONFIG.get("export_batch_size", DEFAULT_BATCH_SIZE))
+    else:
+        singer.write_schema("transactions", schema, ["id"],
+                            bookmark_properties=['created_at'])
+
+    latest_updated_at = utils.strptime_to_utc(STATE.get('latest_updated_at', DEFAULT_TIMESTAMP))
 
     latest_disbursement_date = utils.strptime_to_utc(STATE.get('latest_disbursment_date', DEFAULT_TIMESTAMP))
 
-    run_maximum_disbursement_date = latest_disbursement_date
+    watermarks = Watermarks(latest_updated_at, latest_disbursement_date)
 
     latest_start_date = utils.strptime_to_utc(get_start("transactions"))
 
-    period_start = latest_start_date - TRAILING_DAYS
+    # A previous run stopped by max_run_seconds left the window to resume
+    # from and its high water marks; the stored bookmarks only move once the
+    # whole range has been synced
+    resume = STATE.get(RESUME_KEY)
+    if resume:
+        period_start = utils.strptime_to_utc(resume["window_start"])
+
+        watermarks.max_updated_at = max(
+            watermarks.max_updated_at, utils.strptime_to_utc(resume["max_updated_at"]))
+
+        watermarks.max_disbursement_date = max(
+            watermarks.max_disbursement_date, utils.strptime_to_utc(resume["max_disbursement_date"]))
+
+    else:
+        period_start = latest_start_date - TRAILING_DAYS
 
     period_end = utils.now()
 
+    graphql_client = None
+    graphql_fields = None
+    if CONFIG.get("api_backend") == "graphql":
+        graphql_client = get_graphql_client()
+        graphql_fields = graphql.get_fields(selected_fields)
+        # Refunds are a separate type in the GraphQL API, the transaction
+        # search only returns sales
+        logger.warning("transactions: The GraphQL backend does not return refunds "
+                       "(credit transactions)")
+
+    # The first window of a run always finishes, even past the deadline, so a
+    # window longer than the whole budget cannot stall every run
+    deadline = get_deadline()
+    longest_window = 0
+    windows_completed = 0
+    stopped_early = False
+
+    # Start of the first window not fully synced yet
+    checkpoint_start = period_start
+
+    def checkpoint():
+        # Resuming from here, with the high water marks so far, is safe at
+        # any point of the run
+        STATE[RESUME_KEY] = {
+            "window_start": utils.strftime(checkpoint_start),
+            "max_updated_at": utils.strftime(watermarks.max_updated_at),
+            "max_disbursement_date": utils.strftime(watermarks.max_disbursement_date),
+        }
+
+    emitter = StateEmitter(
+        STATE, checkpoint,
+        every_records=CONFIG.get("state_emit_every_records", 0),
+        every_seconds=CONFIG.get("state_emit_every_seconds", 0),
+        on_window=CONFIG.get("state_emit_on_window", False))
+
+    # Exported files are only complete once closed, so no intermediate state
+    if exporter and emitter.enabled:
+        logger.warning("transactions: Intermediate STATE messages are not written in export mode")
+        emitter = StateEmitter(STATE, checkpoint)
+
     logger.info("transactions: Syncing from {}".format(period_start))
 
     logger.info("transactions: latest_updated_at from {}, disbursement_date from {}".format(
@@ -133,88 +353,132 @@ def sync_transactions():
         latest_start_date
     ))
 
-    # increment through each day (20k results max from api)
-    for start, end in daterange(period_start, period_end):
-
-        end = min(end, period_end)
-
-        data = get_transactions_data(start, end)
-        time_extracted = utils.now()
-
-        logger.info("transactions: Fetched {} records from {} - {}".format(
-            data.maximum_size, start, end
-        ))
-
-        row_written_count = 0
-        row_skipped_count = 0
+    try:
+        # increment through each day (20k results max from api)
+        for start, end in daterange(period_start, period_end):
 
-        for row in data:
-            # Ensure updated_at consistency
-            if not getattr(row, 'updated_at'):
-                row.updated_at = row.created_at
+            end = min(end, period_end)
 
-            transformed = transform_row(row, schema)
-            updated_at = to_utc(row.updated_at)
+            # Do not start a window that is unlikely to finish within the budget
+            if deadline is not None and windows_completed \
+                    and time.monotonic() + longest_window > deadline:
+                logger.info("transactions: Run time budget reached, stopping before {}".format(start))
+                stopped_early = True
+                break
 
-            # if disbursement is successful, get disbursement date
-            # set disbursement datetime to min if not found
+            checkpoint_start = start
 
-            if row.disbursement_details is None:
-                disbursement_date = datetime.min
+            window_clock = time.monotonic()
+            window_started = trace_now_us()
 
+            if graphql_client:
+                data = graphql_client.search_transactions(start, end, graphql_fields)
             else:
-                if row.disbursement_details.disbursement_date is None:
-                    row.disbursement_details.disbursement_date = datetime.min
-
-                disbursement_date = to_utc(datetime.combine(
-                    row.disbursement_details.disbursement_date,
-                    datetime.min.time()))
-
-            # Is this more recent than our past stored value of update_at?
-            # Is this more recent than our past stored value of disbursement_date?
-            # Use >= for updated_at due to non monotonic updated_at values
-            # Use > for disbursement_date - confirming all transactions disbursed
-            # at the same time
-            # Update our high water mark for updated_at and disbursement_date
-            # in this run
-            if (
-                updated_at >= latest_updated_at
-            ) or (
-                disbursement_date >= latest_disbursement_date
-            ):
-
-                run_maximum_updated_at = max(run_maximum_updated_at, updated_at)
-
-                run_maximum_disbursement_date = max(run_maximum_disbursement_date, disbursement_date)
-
-                singer.write_record("transactions", transformed,
-                                    time_extracted=time_extracted)
-                row_written_count += 1
+                data = get_transactions_data(start, end)
+            time_extracted = utils.now()
+
+            if data.maximum_size is not None:
+                logger.info("transactions: Fetched {} records from {} - {}".format(
+                    data.maximum_size, start, end
+                ))
+
+            row_written_count = 0
+            row_skipped_count = 0
+            abandoned = False
+
+            for row in TRACER.iterate_pages(data, start=str(start)):
+                if deadline is not None and windows_completed and time.monotonic() > deadline:
+                    abandoned = True
+                    break
+
+                # Ensure updated_at consistency
+                if not getattr(row, 'updated_at'):
+                    row.updated_at = row.created_at
+
+                if TRACER.sample_transform():
+                    with TRACER.span("transform_row", cat="transform", id=row.id):
+                        transformed = transform_row(row, schema)
+                else:
+                    transformed = transform_row(row, schema)
+                updated_at = to_utc(row.updated_at)
+
+                disbursement_date = get_disbursement_date(row)
+
+                if watermarks.update(updated_at, disbursement_date):
+
+                    if exporter:
+                        exporter.write_record(transformed)
+                    else:
+                        singer.write_record("transactions", transformed,
+                                            time_extracted=time_extracted)
+                    row_written_count += 1
+                    emitter.record_written()
+
+                else:
+
+                    row_skipped_count += 1
+
+            logger.info("transactions: Written {} records from {} - {}".format(
+                row_written_count, start, end
+            ))
+
+            logger.info("transactions: Skipped {} records from {} - {}".format(
+                row_skipped_count, start, end
+            ))
+
+            TRACER.complete("window", window_started, trace_now_us(), start=str(start),
+                            written=row_written_count, skipped=row_skipped_count)
+
+            if abandoned:
+                logger.info("transactions: Run time budget exceeded, abandoned {} - {}".format(
+                    start, end
+                ))
+                stopped_early = True
+                break
+
+            longest_window = max(longest_window, time.monotonic() - window_clock)
+            windows_completed += 1
+
+            checkpoint_start = end
+            if exporter:
+                exporter.finish_partitions(end)
+            emitter.window_completed()
+
+    except BaseException:
+        # Remove incomplete exported files, or leave a resumable bookmark
+        # behind, also when interrupted
+        if exporter:
+            exporter.abort()
+        else:
+            emitter.write_checkpoint()
+        raise
 
-            else:
-
-                row_skipped_count += 1
+    # End day loop
+    if exporter:
+        exporter.close()
 
-        logger.info("transactions: Written {} records from {} - {}".format(
-            row_written_count, start, end
+    if stopped_early:
+        logger.info("transactions: Stopped early. Next run resumes from {}".format(
+            checkpoint_start
         ))
 
-        logger.info("transactions: Skipped {} records from {} - {}".format(
-            row_skipped_count, start, end
-        ))
+        emitter.write_checkpoint()
+
+        return
+
+    STATE.pop(RESUME_KEY, None)
 
-    # End day loop
     logger.info("transactions: Complete. Last updated record: {}".format(
-        run_maximum_updated_at
+        watermarks.max_updated_at
     ))
 
     logger.info("transactions: Complete. Last disbursement date: {}".format(
-        run_maximum_disbursement_date
+        watermarks.max_disbursement_date
     ))
 
-    latest_updated_at = run_maximum_updated_at
+    latest_updated_at = watermarks.max_updated_at
 
-    latest_disbursement_date = run_maximum_disbursement_date
+    latest_disbursement_date = watermarks.max_disbursement_date
 
     STATE['latest_updated_at'] = utils.strftime(latest_updated_at)
 
@@ -223,7 +487,7 @@ def sync_transactions():
 
     utils.update_state(STATE, "transactions", utils.strftime(end))
 
-    singer.write_state(STATE)
+    emitter.write()
 
 
 def do_discover():
@@ -242,9 +506,17 @@ def do_discover():
     logger.info("Finished discover")
 
 
-def do_sync():
+def do_sync(catalog=None):
     logger.info("Starting sync")
-    sync_transactions()
+    try:
+        if CONFIG.get("repair_ids_path"):
+            with TRACER.span("sync_transactions_by_ids"):
+                sync_transactions_by_ids()
+        else:
+            with TRACER.span("sync_transactions"):
+                sync_transactions(get_selected_fields(catalog))
+    finally:
+        TRACER.save()
     logger.info("Sync completed")
 
 
@@ -267,13 +539,130 @@ def main():
     elif request_timeout < 0:
         raise ValueError("Please provide a positive number for `request_timeout`")
 
-    environment = getattr(
-        braintree.Environment, config.pop("environment", "Production")
-    )
+    environment_name = config.pop("environment", "Production")
+    environment = getattr(braintree.Environment, environment_name)
 
     config["timeout"] = request_timeout
     CONFIG['start_date'] = config.pop('start_date')
 
+    export_format = config.pop("export_format", None)
+    if export_format:
+        if export_format != "parquet":
+            raise ValueError("Unsupported `export_format`: {}".format(export_format))
+        if not config.get("export_path"):
+            raise ValueError("`export_path` is required when `export_format` is set")
+        CONFIG['export_format'] = export_format
+    if "export_path" in config:
+        CONFIG['export_path'] = config.pop("export_path")
+
+    if "export_batch_size" in config:
+        try:
+            export_batch_size = int(config.pop("export_batch_size"))
+        except (TypeError, ValueError):
+            raise ValueError("Please provide a positive integer for `export_batch_size`")
+
+        if export_batch_size <= 0:
+            raise ValueError("Please provide a positive integer for `export_batch_size`")
+
+        CONFIG['export_batch_size'] = export_batch_size
+
+    max_run_seconds = None
+    if "max_run_seconds" in config:
+        try:
+            max_run_seconds = float(config.pop("max_run_seconds"))
+        except (TypeError, ValueError):
+            raise ValueError("Please provide a positive number for `max_run_seconds`")
+
+        if max_run_seconds <= 0:
+            raise ValueError("Please provide a positive number for `max_run_seconds`")
+
+        CONFIG['max_run_seconds'] = max_run_seconds
+
+    api_backend = config.pop("api_backend", "sdk")
+    if api_backend not in ("sdk", "graphql"):
+        raise ValueError("Unsupported `api_backend`: {}".format(api_backend))
+
+    if api_backend == "graphql":
+        CONFIG.update({
+            'api_backend': api_backend,
+            'environment': environment_name,
+            'public_key': config["public_key"],
+            'private_key': config["private_key"],
+            'request_timeout': request_timeout,
+        })
+    graphql_url = config.pop("graphql_url", None)
+    if graphql_url:
+        CONFIG['graphql_url'] = graphql_url
+
+    if api_backend == "graphql" and environment_name not in graphql.URLS and not graphql_url:
+        raise ValueError("The GraphQL API has no URL for the {} environment, "
+                         "please provide `graphql_url`".format(environment_name))
+
+    if "graphql_page_size" in config:
+        try:
+            graphql_page_size = int(config.pop("graphql_page_size"))
+        except (TypeError, ValueError):
+            raise ValueError("Please provide an integer from 1 to {} for `graphql_page_size`".format(
+                graphql.MAX_PAGE_SIZE))
+
+        if not 0 < graphql_page_size <= graphql.MAX_PAGE_SIZE:
+            raise ValueError("Please provide an integer from 1 to {} for `graphql_page_size`".format(
+                graphql.MAX_PAGE_SIZE))
+
+        CONFIG['graphql_page_size'] = graphql_page_size
+
+    for key, convert in (("state_emit_every_records", int), ("state_emit_every_seconds", float)):
+        if key in config:
+            try:
+                value = convert(config.pop(key) or 0)
+            except (TypeError, ValueError):
+                raise ValueError("Please provide a non-negative number for `{}`".format(key))
+
+            if value < 0:
+                raise ValueError("Please provide a non-negative number for `{}`".format(key))
+
+            CONFIG[key] = value
+
+    if "state_emit_on_window" in config:
+        on_window = config.pop("state_emit_on_window")
+        if str(on_window).lower() not in ("true", "false"):
+            raise ValueError("Please provide true or false for `state_emit_on_window`")
+
+        CONFIG['state_emit_on_window'] = str(on_window).lower() == "true"
+
+    repair_ids_path = config.pop("repair_ids_path", None)
+    if repair_ids_path:
+        unsupported = [key for key, value in (("export_format", export_format),
+                                              ("max_run_seconds", max_run_seconds),
+                                              ("api_backend", api_backend != "sdk")) if value]
+        if unsupported:
+            raise ValueError("`repair_ids_path` cannot be combined with {}".format(
+                ", ".join("`{}`".format(key) for key in unsupported)))
+        CONFIG['repair_ids_path'] = repair_ids_path
+
+    for key, default in (("repair_batch_size", REPAIR_BATCH_SIZE),
+                         ("repair_concurrency", REPAIR_CONCURRENCY)):
+        try:
+            value = int(config.pop(key, default))
+        except (TypeError, ValueError):
+            raise ValueError("Please provide a positive integer for `{}`".format(key))
+
+        if value <= 0:
+            raise ValueError("Please provide a positive integer for `{}`".format(key))
+
+        CONFIG[key] = value
+
+    trace_path = config.pop("trace_path", None)
+    try:
+        trace_transform_every = int(config.pop("trace_transform_every", 0) or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Please provide a non-negative integer for `trace_transform_every`")
+
+    if trace_transform_every < 0:
+        raise ValueError("Please provide a non-negative integer for `trace_transform_every`")
+    if trace_path:
+        TRACER.configure(trace_path, transform_every=trace_transform_every)
+
     if args.state:
         STATE.update(args.state)
 
@@ -282,7 +671,7 @@ def main():
         if args.discover:
             do_discover()
         elif args.catalog:
-            do_sync()
+            do_sync(args.catalog)
     except AuthenticationError:
         logger.critical('Authentication error occured. '
                         'Please check your merchant_id, public_key, and '
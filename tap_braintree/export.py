@@ -0,0 +1,245 @@
+import json
+import os
+import uuid
+from datetime import datetime
+
+import pytz
+import singer
+from singer import utils
+
+from tap_braintree.trace import TRACER
+
+LOGGER = singer.get_logger()
+
+DEFAULT_BATCH_SIZE = 10000
+MANIFEST_FILE = "manifest-{}.json"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow  # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+    except ImportError as ex:
+        raise Exception("Parquet export requires pyarrow: "
+                        "pip install tap-braintree[parquet]") from ex
+    return pyarrow
+
+
+def _non_null(field_schema):
+    """
+    Return the non-null variant of a property schema, unwrapping anyOf and
+    nullable type lists.
+    """
+    if "anyOf" in field_schema:
+        return _non_null([s for s in field_schema["anyOf"] if s.get("type") != "null"][0])
+
+    typ = field_schema["type"]
+    if isinstance(typ, list):
+        typ = [t for t in typ if t != "null"][0]
+    return dict(field_schema, type=typ)
+
+
+def to_arrow_type(pa, field_schema):
+    """
+    Map a JSON schema property onto an arrow type. Nested objects become
+    structs and date-time strings become UTC timestamps.
+    """
+    field_schema = _non_null(field_schema)
+    typ = field_schema["type"]
+
+    if typ == "object":
+        return pa.struct([pa.field(name, to_arrow_type(pa, sub_schema))
+                          for name, sub_schema in field_schema["properties"].items()])
+    if typ == "array":
+        return pa.list_(to_arrow_type(pa, field_schema["items"]))
+    if field_schema.get("format") == "date-time":
+        return pa.timestamp("us", tz="UTC")
+    if typ == "number":
+        return pa.float64()
+    if typ == "integer":
+        return pa.int64()
+    if typ == "boolean":
+        return pa.bool_()
+    return pa.string()
+
+
+def _to_timestamp(value):
+    # transform_row formats date-times with utils.strftime, which
+    # fromisoformat reads much faster than the generic parser
+    if value.endswith("Z"):
+        try:
+            return datetime.fromisoformat(value[:-1]).replace(tzinfo=pytz.UTC)
+        except ValueError:
+            pass
+    return utils.strptime_to_utc(value)
+
+
+def _convert(convert, value):
+    if convert is None or value is None:
+        return value
+    return convert(value)
+
+
+def value_converter(field_schema):
+    """
+    Return a function converting a transformed record value into what arrow
+    expects for the property's type, or None when values are kept as they
+    are. Built once per property so writing a record does not resolve the
+    schema again.
+    """
+    field_schema = _non_null(field_schema)
+
+    if field_schema["type"] == "object":
+        converters = [(name, value_converter(sub_schema))
+                      for name, sub_schema in field_schema["properties"].items()]
+
+        def convert_object(value):
+            return {name: _convert(convert, value.get(name)) for name, convert in converters}
+        return convert_object
+
+    if field_schema["type"] == "array":
+        convert_item = value_converter(field_schema["items"])
+        if convert_item is None:
+            return None
+
+        def convert_array(value):
+            return [_convert(convert_item, item) for item in value]
+        return convert_array
+
+    if field_schema.get("format") == "date-time":
+        return _to_timestamp
+    return None
+
+
+class ParquetExporter:
+    """
+    Write transformed records to Parquet files partitioned by day.
+
+    Records are buffered column by column and written as a row group every
+    `batch_size` records per partition. `finish_partitions` flushes and
+    closes the days a sync has moved past, so buffers and open files stay
+    bounded on long syncs. `close` flushes the remaining buffers and writes
+    a manifest describing every file written, `abort` removes them instead.
+    File and manifest names carry a run id so a run never replaces what
+    earlier runs exported.
+    """
+
+    def __init__(self, stream, schema, path, partition_key,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.pa = _import_pyarrow()
+        self.stream = stream
+        self.properties = schema["properties"]
+        self.path = path
+        self.partition_key = partition_key
+        self.batch_size = batch_size
+        self.run_id = "{}-{}".format(utils.now().strftime("%Y%m%dT%H%M%SZ"), uuid.uuid4().hex[:8])
+        self.arrow_schema = self.pa.schema(
+            [self.pa.field(name, to_arrow_type(self.pa, field_schema))
+             for name, field_schema in self.properties.items()])
+        self.converters = [(name, value_converter(field_schema))
+                           for name, field_schema in self.properties.items()]
+        self.buffers = {}
+        self.writers = {}
+        self.files = []
+
+    def _partition(self, record):
+        return record[self.partition_key][:10]
+
+    def _open_writer(self, partition):
+        # A partition finished earlier in the run gets another file rather
+        # than replacing the first one
+        previous = sum(1 for entry in self.files if entry["partition"] == partition)
+        file_name = "part-{}.parquet".format(self.run_id) if not previous \
+            else "part-{}-{}.parquet".format(self.run_id, previous)
+        file_path = os.path.join(self.path, self.stream, "date={}".format(partition), file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        entry = {
+            "partition": partition,
+            "path": os.path.relpath(file_path, self.path),
+            "row_count": 0,
+        }
+        self.files.append(entry)
+        self.writers[partition] = (self.pa.parquet.ParquetWriter(file_path, self.arrow_schema),
+                                   entry)
+        return self.writers[partition]
+
+    def write_record(self, record):
+        partition = self._partition(record)
+        columns = self.buffers.get(partition)
+        if columns is None:
+            columns = self.buffers[partition] = {name: [] for name in self.properties}
+
+        for name, convert in self.converters:
+            columns[name].append(_convert(convert, record.get(name)))
+
+        if len(columns[self.partition_key]) >= self.batch_size:
+            self._flush(partition)
+
+    def _flush(self, partition):
+        columns = self.buffers.pop(partition, None)
+        if not columns or not columns[self.partition_key]:
+            return
+
+        writer, entry = self.writers.get(partition) or self._open_writer(partition)
+
+        with TRACER.span("flush", cat="export", partition=partition):
+            table = self.pa.Table.from_pydict(columns, schema=self.arrow_schema)
+            writer.write_table(table)
+        entry["row_count"] += table.num_rows
+
+    def _finish(self, partitions):
+        for partition in partitions:
+            self._flush(partition)
+            writer, _ = self.writers.pop(partition, (None, None))
+            if writer:
+                writer.close()
+
+    def finish_partitions(self, before):
+        """
+        Flush and close the partitions of days before `before`, which the
+        sync will not write to again.
+        """
+        before = before.strftime("%Y-%m-%d")
+        self._finish(sorted(partition for partition in set(self.buffers) | set(self.writers)
+                            if partition < before))
+
+    def close(self):
+        """Flush all buffers, close the files and write the manifest."""
+        self._finish(sorted(set(self.buffers) | set(self.writers)))
+
+        manifest = {
+            "run_id": self.run_id,
+            "stream": self.stream,
+            "partition_key": self.partition_key,
+            "files": sorted(self.files, key=lambda entry: (entry["partition"], entry["path"])),
+            "row_count": sum(entry["row_count"] for entry in self.files),
+        }
+
+        os.makedirs(self.path, exist_ok=True)
+        manifest_path = os.path.join(self.path, MANIFEST_FILE.format(self.run_id))
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+        LOGGER.info("%s: Exported %s records to %s files, manifest at %s",
+                    self.stream, manifest["row_count"], len(manifest["files"]),
+                    manifest_path)
+
+        return manifest
+
+    def abort(self):
+        """
+        Close and delete the files written so far without a manifest, as
+        a failed run leaves them incomplete.
+        """
+        for writer, _ in self.writers.values():
+            writer.close()
+        for entry in self.files:
+            os.remove(os.path.join(self.path, entry["path"]))
+
+        LOGGER.info("%s: Export aborted, removed %s partial files",
+                    self.stream, len(self.files))
+
+        self.buffers = {}
+        self.writers = {}
+        self.files = []
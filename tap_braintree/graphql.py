@@ -0,0 +1,338 @@
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import requests
+import singer
+from singer import utils
+
+from braintree.credit_card import CreditCard
+from braintree.exceptions.authentication_error import AuthenticationError
+from braintree.exceptions.too_many_requests_error import TooManyRequestsError
+from braintree.exceptions.server_error import ServerError
+from braintree.exceptions.service_unavailable_error import ServiceUnavailableError
+from braintree.exceptions.gateway_timeout_error import GatewayTimeoutError
+
+from tap_braintree.retry import retry_api_errors
+from tap_braintree.trace import TRACER
+
+LOGGER = singer.get_logger()
+
+API_VERSION = "2019-01-01"
+DEFAULT_PAGE_SIZE = 50
+# The API rejects searches asking for more results per page
+MAX_PAGE_SIZE = 50
+URLS = {
+    "Production": "https://payments.braintree-api.com/graphql",
+    "Sandbox": "https://payments.sandbox.braintree-api.com/graphql",
+}
+
+# Properties always fetched because the sync needs them for its bookmarks
+REQUIRED_FIELDS = ["id", "created_at", "updated_at", "disbursement_details"]
+
+SEARCH_QUERY = """
+query SearchTransactions($input: TransactionSearchInput!, $first: Int!, $after: String) {
+  search {
+    transactions(input: $input, first: $first, after: $after) {
+      pageInfo { hasNextPage endCursor }
+      edges { node { %s } }
+    }
+  }
+}
+"""
+
+
+class GraphQLError(Exception):
+    """Raise when the GraphQL API answers with errors"""
+
+
+def _path(node, *keys):
+    for key in keys:
+        if node is None:
+            return None
+        node = node.get(key)
+    return node
+
+
+def _lower(value):
+    return value.lower() if value else None
+
+
+def _decimal(value):
+    return Decimal(value) if value is not None else None
+
+
+def _datetime(value):
+    return utils.strptime_to_utc(value) if value else None
+
+
+def _date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+def _snapshot(node, typename):
+    snapshot = node.get("paymentMethodSnapshot")
+    if snapshot and snapshot.get("__typename") == typename:
+        return snapshot
+    return None
+
+
+# GraphQL brand codes -> the SDK's card type names
+CARD_TYPES = {
+    "AMERICAN_EXPRESS": CreditCard.CardType.AmEx,
+    "CARTE_BLANCHE": CreditCard.CardType.CarteBlanche,
+    "CHINA_UNION_PAY": CreditCard.CardType.ChinaUnionPay,
+    "UNION_PAY": CreditCard.CardType.ChinaUnionPay,
+    "DINERS": CreditCard.CardType.DinersClubInternational,
+    "DISCOVER": CreditCard.CardType.Discover,
+    "ELO": CreditCard.CardType.Elo,
+    "HIPER": CreditCard.CardType.Hiper,
+    "HIPERCARD": CreditCard.CardType.Hipercard,
+    "INTERNATIONAL_MAESTRO": CreditCard.CardType.Maestro,
+    "JCB": CreditCard.CardType.JCB,
+    "LASER": CreditCard.CardType.Laser,
+    "MASTERCARD": CreditCard.CardType.MasterCard,
+    "SOLO": CreditCard.CardType.Solo,
+    "SWITCH": CreditCard.CardType.Switch,
+    "UK_MAESTRO": CreditCard.CardType.UK_Maestro,
+    "VISA": CreditCard.CardType.Visa,
+    "UNKNOWN": CreditCard.CardType.Unknown,
+}
+
+
+def _card_type(brand_code):
+    return CARD_TYPES.get(brand_code, brand_code)
+
+
+def _updated_at(node):
+    # The GraphQL API has no last-modified time, the latest status change is
+    # the closest equivalent
+    timestamps = [event["timestamp"] for event in node.get("statusHistory") or []]
+    return _datetime(max(timestamps)) if timestamps else None
+
+
+def _customer_details(node):
+    customer = node.get("customer")
+    if customer is None:
+        return None
+    return SimpleNamespace(
+        id=customer.get("legacyId"),
+        email=customer.get("email"),
+        first_name=customer.get("firstName"),
+        last_name=customer.get("lastName"),
+        company=customer.get("company"),
+        phone=customer.get("phoneNumber"),
+        website=customer.get("website"),
+    )
+
+
+def _credit_card_details(node):
+    snapshot = _snapshot(node, "CreditCardDetails")
+    if snapshot is None:
+        return None
+    return SimpleNamespace(
+        customer_location=None,
+        card_type=_card_type(snapshot.get("brandCode")),
+    )
+
+
+def _paypal_details(node):
+    snapshot = _snapshot(node, "PayPalTransactionDetails")
+    if snapshot is None:
+        return None
+    return SimpleNamespace(
+        authorization_id=snapshot.get("authorizationId"),
+        capture_id=snapshot.get("captureId"),
+        payer_email=_path(snapshot, "payer", "email"),
+        payer_id=_path(snapshot, "payer", "payerId"),
+        payer_status=_path(snapshot, "payerStatus"),
+        payment_id=snapshot.get("paymentId"),
+        refund_id=snapshot.get("refundId"),
+        seller_protection_status=_lower(snapshot.get("sellerProtectionStatus")),
+        tax_id=None,
+        tax_id_type=None,
+        transaction_fee_amount=_path(snapshot, "transactionFee", "value"),
+        transaction_fee_currency_iso_code=_path(snapshot, "transactionFee", "currencyCode"),
+    )
+
+
+def _disbursement_details(node):
+    details = node.get("disbursementDetails") or {}
+    return SimpleNamespace(
+        disbursement_date=_date(details.get("date")),
+        success=details.get("success"),
+    )
+
+
+PAYMENT_INSTRUMENT_TYPES = {
+    "CreditCardDetails": "credit_card",
+    "PayPalTransactionDetails": "paypal_account",
+    "VenmoAccountDetails": "venmo_account",
+}
+
+# transactions.json property -> (GraphQL selection, value from a transaction node).
+# Properties without a GraphQL equivalent are listed in UNMAPPED_FIELDS.
+# `updated_at` is the latest status change and credit card
+# `customer_location` is always None, see README.md.
+FIELDS = {
+    "id": ("legacyId", lambda node: node["legacyId"]),
+    "created_at": ("createdAt", lambda node: _datetime(node["createdAt"])),
+    "updated_at": ("statusHistory { timestamp }", _updated_at),
+    "status": ("status", lambda node: _lower(node.get("status"))),
+    "amount": ("amount { value }", lambda node: _decimal(_path(node, "amount", "value"))),
+    "currency_iso_code": ("amount { currencyCode }",
+                          lambda node: _path(node, "amount", "currencyCode")),
+    "payment_instrument_type": (
+        "paymentMethodSnapshot { __typename }",
+        lambda node: PAYMENT_INSTRUMENT_TYPES.get(_path(node, "paymentMethodSnapshot", "__typename"))),
+    "order_id": ("orderId", lambda node: node.get("orderId")),
+    "merchant_account_id": ("merchantAccountId", lambda node: node.get("merchantAccountId")),
+    "gateway_rejection_reason": ("gatewayRejectionReason",
+                                 lambda node: _lower(node.get("gatewayRejectionReason"))),
+    "processor_authorization_code": (
+        "processorResponse { authorizationId }",
+        lambda node: _path(node, "processorResponse", "authorizationId")),
+    "processor_response_code": ("processorResponse { legacyCode }",
+                                lambda node: _path(node, "processorResponse", "legacyCode")),
+    "processor_response_text": ("processorResponse { message }",
+                                lambda node: _path(node, "processorResponse", "message")),
+    "customer_details": (
+        "customer { legacyId email firstName lastName company phoneNumber website }",
+        _customer_details),
+    "credit_card_details": (
+        "paymentMethodSnapshot { __typename ... on CreditCardDetails { brandCode } }",
+        _credit_card_details),
+    "paypal_details": (
+        "paymentMethodSnapshot { __typename ... on PayPalTransactionDetails { "
+        "authorizationId captureId payer { email payerId } payerStatus paymentId refundId "
+        "sellerProtectionStatus transactionFee { value currencyCode } } }",
+        _paypal_details),
+    "disbursement_details": ("disbursementDetails { date success }", _disbursement_details),
+}
+
+UNMAPPED_FIELDS = [
+    "settlement_batch_id", "type", "service_fee_amount", "plan_id", "recurring",
+    "refunded_transaction_id", "subscription_id", "subscription_details",
+]
+
+
+def build_transaction_query(fields):
+    """Return the search query selecting only what `fields` need."""
+    selections = list(dict.fromkeys(FIELDS[field][0] for field in fields))
+    return SEARCH_QUERY % " ".join(selections)
+
+
+def to_transaction(node, fields):
+    """
+    Build a Transaction-like object from a GraphQL transaction node, with an
+    attribute for each of `fields` as the SDK would expose it.
+    """
+    return SimpleNamespace(**{field: FIELDS[field][1](node) for field in fields})
+
+
+class TransactionSearchResults:
+    """
+    Iterate over a transaction search, following the page cursors.
+
+    The first page is fetched on creation so request errors surface from the
+    search call itself, later pages are fetched while iterating.
+    """
+
+    # The GraphQL search does not return the size of the result set
+    maximum_size = None
+
+    def __init__(self, client, variables, fields):
+        self.client = client
+        self.variables = variables
+        self.fields = fields
+        self.query = build_transaction_query(fields)
+        self.first_page = self._fetch(None)
+
+    def _fetch(self, cursor):
+        variables = dict(self.variables, after=cursor)
+        data = self.client.execute(self.query, variables)
+        return data["search"]["transactions"]
+
+    def __iter__(self):
+        page = self.first_page
+        while True:
+            for edge in page["edges"]:
+                yield to_transaction(edge["node"], self.fields)
+
+            if not page["pageInfo"]["hasNextPage"]:
+                return
+
+            page = self._fetch(page["pageInfo"]["endCursor"])
+
+
+class GraphQLClient:
+    """Client for Braintree's GraphQL API."""
+
+    def __init__(self, url, public_key, private_key, timeout, page_size=DEFAULT_PAGE_SIZE):
+        self.url = url
+        self.timeout = timeout
+        self.page_size = page_size
+        self.session = requests.Session()
+        self.session.auth = (public_key, private_key)
+        self.session.headers.update({
+            "Braintree-Version": API_VERSION,
+            "Content-Type": "application/json",
+        })
+
+    @retry_api_errors
+    def execute(self, query, variables):
+        with TRACER.span("graphql", cat="api"):
+            try:
+                response = self.session.post(self.url, json={"query": query, "variables": variables},
+                                             timeout=self.timeout)
+            except requests.exceptions.ConnectionError as ex:
+                raise ConnectionError(str(ex)) from ex
+
+        if response.status_code == 401:
+            raise AuthenticationError()
+        if response.status_code == 429:
+            raise TooManyRequestsError()
+        if response.status_code == 503:
+            raise ServiceUnavailableError()
+        if response.status_code == 504:
+            raise GatewayTimeoutError()
+        if response.status_code >= 500:
+            raise ServerError()
+        response.raise_for_status()
+
+        body = response.json()
+        if body.get("errors"):
+            raise GraphQLError("; ".join(error.get("message", str(error))
+                                         for error in body["errors"]))
+        return body["data"]
+
+    def search_transactions(self, start, end, fields):
+        """Search transactions created between `start` and `end`, both inclusive."""
+        variables = {
+            "input": {
+                "createdAt": {
+                    "greaterThanOrEqualTo": utils.strftime(start),
+                    "lessThanOrEqualTo": utils.strftime(end),
+                },
+            },
+            "first": self.page_size,
+        }
+        return TransactionSearchResults(self, variables, fields)
+
+
+def get_fields(selected_fields=None):
+    """
+    Return the properties to request, keeping the ones the sync always needs
+    and warning about selected properties the GraphQL API does not offer.
+    Without a selection every available property is requested.
+    """
+    if selected_fields is None:
+        selected_fields = list(FIELDS)
+
+    unmapped = [field for field in selected_fields if field in UNMAPPED_FIELDS]
+    if unmapped:
+        LOGGER.warning("transactions: %s are not available from the GraphQL API "
+                       "and will be omitted", ", ".join(unmapped))
+
+    return REQUIRED_FIELDS + [field for field in FIELDS
+                              if field in selected_fields and field not in REQUIRED_FIELDS]
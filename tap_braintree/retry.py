@@ -0,0 +1,28 @@
+import backoff
+
+from braintree.exceptions.too_many_requests_error import TooManyRequestsError
+from braintree.exceptions.server_error import ServerError
+from braintree.exceptions.service_unavailable_error import ServiceUnavailableError
+from braintree.exceptions.gateway_timeout_error import GatewayTimeoutError
+
+from tap_braintree.trace import TRACER
+
+
+def trace_backoff(details):
+    TRACER.instant("retry", cat="api", tries=details["tries"], wait=details["wait"])
+
+
+# Retry policy shared by every Braintree API call
+retry_api_errors = backoff.on_exception(
+    backoff.expo,
+    (
+        ConnectionError,
+        TooManyRequestsError,
+        ServerError,
+        ServiceUnavailableError,
+        GatewayTimeoutError,
+    ),
+    max_tries=5,
+    factor=2,
+    on_backoff=trace_backoff,
+)
@@ -0,0 +1,59 @@
+import time
+
+import singer
+
+from tap_braintree.trace import TRACER
+
+
+class StateEmitter:
+    """
+    Decide when STATE messages are written during a sync.
+
+    Intermediate states are written every `every_records` records, every
+    `every_seconds` seconds and/or at the end of every window; with none of
+    them set only the final state is written. Bookmark updates in between
+    are coalesced: `checkpoint` is only called to bring the state up to date
+    right before it is written.
+    """
+
+    def __init__(self, state, checkpoint, every_records=0, every_seconds=0, on_window=False):
+        self.state = state
+        self.checkpoint = checkpoint
+        self.every_records = every_records
+        self.every_seconds = every_seconds
+        self.on_window = on_window
+        self.pending_records = 0
+        self.last_written = time.monotonic()
+
+    @property
+    def enabled(self):
+        return bool(self.every_records or self.every_seconds or self.on_window)
+
+    def _seconds_elapsed(self):
+        return self.every_seconds and time.monotonic() - self.last_written >= self.every_seconds
+
+    def record_written(self):
+        if not self.enabled:
+            return
+
+        self.pending_records += 1
+        if (self.every_records and self.pending_records >= self.every_records) \
+                or self._seconds_elapsed():
+            self.write_checkpoint()
+
+    def window_completed(self):
+        if not self.enabled:
+            return
+
+        if self.on_window or self._seconds_elapsed():
+            self.write_checkpoint()
+
+    def write_checkpoint(self):
+        self.checkpoint()
+        self.write()
+
+    def write(self):
+        with TRACER.span("write_state", cat="state"):
+            singer.write_state(self.state)
+        self.pending_records = 0
+        self.last_written = time.monotonic()
@@ -0,0 +1,111 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()
+
+# The SDK fetches search result pages lazily while the results are iterated,
+# so any wait for the next result longer than this is recorded as a page fetch
+PAGE_WAIT_THRESHOLD_US = 1000
+
+
+def now_us():
+    return time.perf_counter_ns() // 1000
+
+
+class Tracer:
+    """
+    Record a sync timeline as Chrome trace events.
+
+    The recorder is disabled until `configure` is given a path, in which case
+    every span and instant event is kept in memory and written by `save` as a
+    trace-event JSON file that chrome://tracing, Perfetto or speedscope open.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.transform_every = 0
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self._transform_count = 0
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def configure(self, path, transform_every=0):
+        self.path = path
+        self.transform_every = transform_every
+        self.events = []
+        self._transform_count = 0
+
+    def _add(self, event):
+        event.update(pid=self.pid, tid=threading.get_ident())
+        with self.lock:
+            self.events.append(event)
+
+    def complete(self, name, start_us, end_us, cat="sync", **args):
+        if not self.enabled:
+            return
+        self._add({"name": name, "cat": cat, "ph": "X", "ts": start_us,
+                   "dur": end_us - start_us, "args": args})
+
+    def instant(self, name, cat="sync", **args):
+        if not self.enabled:
+            return
+        self._add({"name": name, "cat": cat, "ph": "i", "s": "t",
+                   "ts": now_us(), "args": args})
+
+    @contextlib.contextmanager
+    def span(self, name, cat="sync", **args):
+        if not self.enabled:
+            yield
+            return
+        start = now_us()
+        try:
+            yield
+        finally:
+            self.complete(name, start, now_us(), cat, **args)
+
+    def iterate_pages(self, results, **args):
+        """Yield from `results`, recording waits on the SDK as page fetches."""
+        if not self.enabled:
+            yield from results
+            return
+        iterator = iter(results)
+        page = 0
+        while True:
+            start = now_us()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            end = now_us()
+            if end - start >= PAGE_WAIT_THRESHOLD_US:
+                self.complete("fetch_page", start, end, "api", page=page, **args)
+                page += 1
+            yield item
+
+    def sample_transform(self):
+        """Return True when this transform_row call should be recorded."""
+        if not self.enabled or not self.transform_every:
+            return False
+        self._transform_count += 1
+        return self._transform_count % self.transform_every == 0
+
+    def save(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            events = list(self.events)
+        with open(self.path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+        LOGGER.info("Wrote %s trace events to %s", len(events), self.path)
+
+
+TRACER = Tracer()
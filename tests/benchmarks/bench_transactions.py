@@ -0,0 +1,246 @@
+"""
+Micro-benchmarks for the per-record path of `sync_transactions`.
+
+Each stage of the record loop is timed separately against synthetic
+Transaction-like objects generated from `schemas/transactions.json`:
+
+    * transform     - transform_row(row, schema)
+    * disbursement  - get_disbursement_date(row)
+    * watermark     - updated_at / disbursement_date bookmark comparisons
+    * write_record  - singer.write_record (stdout sent to os.devnull)
+
+Usage:
+
+    python tests/benchmarks/bench_transactions.py [--records N] [--repeat N]
+        [--save-baseline FILE] [--baseline FILE] [--tolerance 0.5]
+
+When `--baseline` is given the run exits non-zero if any stage is slower
+than the saved ns/record by more than the tolerance. Comparisons need at
+least MIN_COMPARE_RECORDS records and MIN_COMPARE_REPEAT repeats, smaller
+runs are too noisy to tell a regression apart.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+
+import singer
+
+from tap_braintree import load_schema, to_utc, get_disbursement_date, Watermarks
+from tap_braintree.transform import transform_row
+from singer import utils
+
+
+MIN_COMPARE_RECORDS = 1000
+MIN_COMPARE_REPEAT = 5
+
+STAGES = ["transform", "disbursement", "watermark", "write_record"]
+VARIANTS = ["full", "null_heavy"]
+BASE_DATE = datetime(2024, 1, 1)
+LATEST_UPDATED_AT = to_utc(BASE_DATE + timedelta(days=15))
+LATEST_DISBURSEMENT_DATE = to_utc(BASE_DATE + timedelta(days=15))
+
+
+def _value(field_schema, field_name, rnd, null_heavy):
+    """Return a synthetic value matching a single schema property."""
+    if "anyOf" in field_schema:
+        non_null = [s for s in field_schema["anyOf"] if s.get("type") != "null"]
+        if null_heavy or rnd.random() < 0.1:
+            return None
+        return _value(non_null[0], field_name, rnd, null_heavy)
+
+    typ = field_schema["type"]
+    if typ == "object":
+        return _object(field_schema["properties"], rnd, null_heavy)
+
+    if isinstance(typ, list) and "null" in typ and null_heavy and rnd.random() < 0.8:
+        return None
+
+    if field_schema.get("format") == "date-time":
+        moment = BASE_DATE + timedelta(seconds=rnd.randrange(86400 * 30))
+        if field_name.endswith("_date") and field_name != "created_at":
+            return moment.date()
+        return moment
+
+    types = typ if isinstance(typ, list) else [typ]
+    if "number" in types:
+        return Decimal("{:.2f}".format(rnd.uniform(1, 1000)))
+    if "integer" in types:
+        return rnd.randrange(1, 100000)
+    if "boolean" in types:
+        return rnd.random() < 0.5
+    return "{}-{:08x}".format(field_name, rnd.getrandbits(32))
+
+
+def _object(properties, rnd, null_heavy):
+    return SimpleNamespace(**{
+        field: _value(field_schema, field, rnd, null_heavy)
+        for field, field_schema in properties.items()
+    })
+
+
+def make_rows(schema, count, null_heavy=False, seed=0):
+    """
+    Build `count` Transaction-like objects for the given schema.
+
+    Rows expose the same attributes as braintree.Transaction for every
+    property in the schema, including the nested detail objects. The
+    null-heavy variant leaves most nullable fields and details unset.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        row = _object(schema["properties"], rnd, null_heavy)
+        if null_heavy:
+            # sync_transactions backfills a missing updated_at from created_at
+            row.updated_at = row.created_at
+        rows.append(row)
+    return rows
+
+
+def _run_stage(stage, rows, schema):
+    """Run one stage over all rows and return its outputs."""
+    if stage == "transform":
+        return [transform_row(row, schema) for row in rows]
+
+    if stage == "disbursement":
+        return [get_disbursement_date(row) for row in rows]
+
+    if stage == "watermark":
+        # Bookmarks halfway through the generated range, so both comparisons
+        # are exercised instead of short-circuiting on updated_at
+        watermarks = Watermarks(LATEST_UPDATED_AT, LATEST_DISBURSEMENT_DATE)
+        return [row for row in rows
+                if watermarks.update(to_utc(row.updated_at), row.disbursement_date)]
+
+    if stage == "write_record":
+        time_extracted = utils.now()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for record in rows:
+                singer.write_record("transactions", record,
+                                    time_extracted=time_extracted)
+        return None
+
+    raise ValueError("Unknown stage {}".format(stage))
+
+
+def _stage_input(stage, rows, schema):
+    """Prepare the per-stage input so only the stage itself is measured."""
+    if stage == "watermark":
+        for row in rows:
+            row.disbursement_date = get_disbursement_date(row)
+    if stage == "write_record":
+        return [transform_row(row, schema) for row in rows]
+    return rows
+
+
+def measure(stage, rows, schema, repeat):
+    """
+    Return ns/record (best of `repeat`) and memory figures for a stage.
+
+    Memory figures come from tracemalloc over a single extra pass.
+    `retained_blocks_per_record` counts the memory blocks the stage's
+    outputs still hold after the pass, not every allocation made while
+    running it.
+    `peak_bytes_per_record` is the peak traced memory growth during the pass.
+    """
+    rows = _stage_input(stage, rows, schema)
+    count = len(rows)
+
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        _run_stage(stage, rows, schema)
+        elapsed = time.perf_counter_ns() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    baseline_size = tracemalloc.get_traced_memory()[0]
+    result = _run_stage(stage, rows, schema)
+    peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename")
+                 if stat.count_diff > 0)
+
+    return {
+        "ns_per_record": best / count,
+        "retained_blocks_per_record": blocks / count,
+        "peak_bytes_per_record": (peak - baseline_size) / count,
+    }
+
+
+def run(records, repeat):
+    schema = load_schema("transactions")
+    results = {}
+    for variant in VARIANTS:
+        for stage in STAGES:
+            rows = make_rows(schema, records, null_heavy=(variant == "null_heavy"))
+            results["{}.{}".format(variant, stage)] = measure(stage, rows, schema, repeat)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the list of stages slower than the baseline by more than `tolerance`."""
+    regressions = []
+    for name, figures in results.items():
+        if name not in baseline:
+            continue
+        previous = baseline[name]["ns_per_record"]
+        current = figures["ns_per_record"]
+        if previous and current > previous * (1 + tolerance):
+            regressions.append("{}: {:.0f} ns/record (baseline {:.0f})".format(
+                name, current, previous))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save-baseline", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare results against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed slowdown against the baseline (0.5 = 50%%)")
+    args = parser.parse_args()
+
+    if args.baseline and (args.records < MIN_COMPARE_RECORDS or args.repeat < MIN_COMPARE_REPEAT):
+        parser.error("--baseline needs at least --records {} and --repeat {}".format(
+            MIN_COMPARE_RECORDS, MIN_COMPARE_REPEAT))
+
+    results = run(args.records, args.repeat)
+
+    print("{:<28} {:>14} {:>16} {:>20}".format(
+        "stage", "ns/record", "retained blocks", "peak bytes/record"))
+    for name, figures in results.items():
+        print("{:<28} {:>14.0f} {:>16.2f} {:>20.0f}".format(
+            name, figures["ns_per_record"], figures["retained_blocks_per_record"],
+            figures["peak_bytes_per_record"]))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
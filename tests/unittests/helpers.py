@@ -0,0 +1,38 @@
+from datetime import datetime, date
+from types import SimpleNamespace
+
+
+class Results(list):
+    """List standing in for the SDK's ResourceCollection"""
+
+    @property
+    def maximum_size(self):
+        return len(self)
+
+
+def make_transaction(id, created_at, disbursement_date=date(2018, 1, 1)):
+    return SimpleNamespace(
+        id=id, created_at=created_at, updated_at=created_at,
+        disbursement_details=SimpleNamespace(disbursement_date=disbursement_date, success=True))
+
+
+def search_daily(start, end):
+    """Search returning one transaction created at 10:00 on the window's day"""
+    created_at = datetime(start.year, start.month, start.day, 10)
+    return Results([make_transaction(str(start.day), created_at)])
+
+
+def failing_search(error):
+    """Daily search raising `error` for the window starting on January 5th"""
+    def search(start, end):
+        if start.month == 1 and start.day == 5:
+            raise error
+        return search_daily(start, end)
+    return search
+
+
+def make_args(**config):
+    """Parsed command line for main() with dummy credentials, overridden by `config`"""
+    config = dict({"merchant_id": "test", "public_key": "test", "private_key": "test",
+                   "start_date": "2018-01-01T00:00:00Z", "environment": "Sandbox"}, **config)
+    return SimpleNamespace(config=config, state={}, discover=False, catalog=None)
@@ -0,0 +1,230 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import pytz
+
+import tap_braintree
+from tap_braintree import load_schema
+from tap_braintree.export import ParquetExporter, MANIFEST_FILE, value_converter
+
+from .helpers import failing_search, make_args, search_daily
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def make_record(id, created_at, amount=None, disbursement_details=None):
+    return {
+        "id": id,
+        "created_at": created_at,
+        "updated_at": created_at,
+        "amount": amount,
+        "customer_details": {"id": "cust-" + id, "email": None},
+        "disbursement_details": disbursement_details,
+    }
+
+
+class TestValueConverter(unittest.TestCase):
+
+    def test_converts_nested_date_times(self):
+        """
+        Date-times are parsed wherever they are nested, other values are
+        left alone and properties without date-times need no conversion
+        """
+        schema = load_schema("transactions")["properties"]
+        convert = value_converter(schema["disbursement_details"])
+
+        self.assertEqual(
+            convert({"disbursement_date": "2018-01-03T00:00:00.000000Z", "success": True}),
+            {"disbursement_date": datetime(2018, 1, 3, tzinfo=pytz.UTC), "success": True})
+        self.assertEqual(value_converter(schema["created_at"])("2018-01-03T10:00:00+02:00"),
+                         datetime(2018, 1, 3, 8, tzinfo=pytz.UTC))
+        self.assertIsNone(value_converter(schema["amount"]))
+        self.assertIsNone(value_converter(schema["customer_details"])({"id": None})["id"])
+
+@unittest.skipUnless(pq, "pyarrow is not installed")
+class TestParquetExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.schema = load_schema("transactions")
+
+    def test_partitions_by_day_and_writes_manifest(self):
+        """
+        Records are split into one file per created_at day, across several
+        row groups when the batch size is exceeded, and listed in the manifest.
+        """
+        exporter = ParquetExporter("transactions", self.schema, self.tmp.name,
+                                   "created_at", batch_size=2)
+        exporter.write_record(make_record("1", "2018-01-01T10:00:00.000000Z", 1.5))
+        exporter.write_record(make_record("2", "2018-01-01T11:00:00.000000Z"))
+        exporter.write_record(make_record("3", "2018-01-01T12:00:00.000000Z", 3.0))
+        exporter.write_record(make_record(
+            "4", "2018-01-02T10:00:00.000000Z",
+            disbursement_details={"disbursement_date": "2018-01-03T00:00:00.000000Z",
+                                  "success": True}))
+        manifest = exporter.close()
+
+        with open(os.path.join(self.tmp.name, MANIFEST_FILE.format(exporter.run_id))) as manifest_file:
+            self.assertEqual(json.load(manifest_file), manifest)
+
+        self.assertEqual(manifest["row_count"], 4)
+        self.assertEqual(
+            [(f["partition"], f["row_count"]) for f in manifest["files"]],
+            [("2018-01-01", 3), ("2018-01-02", 1)]
+        )
+
+        first_day = pq.ParquetFile(os.path.join(self.tmp.name, manifest["files"][0]["path"]))
+        self.assertEqual(first_day.num_row_groups, 2)
+
+        rows = pq.read_table(os.path.join(self.tmp.name, manifest["files"][1]["path"])).to_pylist()
+        self.assertEqual(rows[0]["created_at"], datetime(2018, 1, 2, 10, tzinfo=pytz.UTC))
+        self.assertEqual(rows[0]["customer_details"]["id"], "cust-4")
+        self.assertEqual(rows[0]["disbursement_details"],
+                         {"disbursement_date": datetime(2018, 1, 3, tzinfo=pytz.UTC),
+                          "success": True})
+        self.assertIsNone(rows[0]["paypal_details"])
+
+    def test_finish_partitions(self):
+        """
+        Days before the given one are flushed and closed, a record arriving
+        for a finished day goes to another file of the run
+        """
+        exporter = ParquetExporter("transactions", self.schema, self.tmp.name, "created_at")
+        exporter.write_record(make_record("1", "2018-01-01T10:00:00.000000Z"))
+        exporter.write_record(make_record("2", "2018-01-02T10:00:00.000000Z"))
+
+        exporter.finish_partitions(datetime(2018, 1, 2, tzinfo=pytz.UTC))
+
+        self.assertEqual(list(exporter.buffers), ["2018-01-02"])
+        self.assertEqual(exporter.writers, {})
+        self.assertEqual(pq.read_table(os.path.join(self.tmp.name, exporter.files[0]["path"]))
+                         .num_rows, 1)
+
+        exporter.write_record(make_record("3", "2018-01-01T11:00:00.000000Z"))
+        manifest = exporter.close()
+
+        self.assertEqual(
+            [(f["partition"], f["row_count"]) for f in manifest["files"]],
+            [("2018-01-01", 1), ("2018-01-01", 1), ("2018-01-02", 1)]
+        )
+        self.assertEqual(len({f["path"] for f in manifest["files"]}), 3)
+
+
+@unittest.skipUnless(pq, "pyarrow is not installed")
+@mock.patch("tap_braintree.singer.write_state")
+@mock.patch("tap_braintree.singer.write_record")
+@mock.patch("tap_braintree.utils.now", return_value=datetime(2018, 2, 1, 12, tzinfo=pytz.UTC))
+class TestParquetSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        tap_braintree.CONFIG.clear()
+        tap_braintree.STATE.clear()
+        tap_braintree.CONFIG.update({
+            "start_date": "2018-01-30T00:00:00Z",
+            "export_format": "parquet",
+            "export_path": self.tmp.name,
+        })
+        tap_braintree.STATE["transactions"] = "2018-01-30T00:00:00Z"
+
+    def manifests(self):
+        return sorted(name for name in os.listdir(self.tmp.name) if name.startswith("manifest-"))
+
+    def test_sync_exports_instead_of_records(self, mocked_now, mocked_write_record,
+                                             mocked_write_state):
+        """
+        An export sync writes Parquet files and a manifest rather than
+        RECORD messages, and a later run adds files instead of replacing them
+        """
+        with mock.patch("tap_braintree.get_transactions_data", side_effect=search_daily):
+            tap_braintree.sync_transactions()
+
+        mocked_write_record.assert_not_called()
+        mocked_write_state.assert_called_once()
+        self.assertEqual(len(self.manifests()), 1)
+        with open(os.path.join(self.tmp.name, self.manifests()[0])) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(manifest["row_count"], 33)
+        self.assertEqual(len(manifest["files"]), 33)
+        self.assertIn(manifest["run_id"], manifest["files"][0]["path"])
+
+        tap_braintree.STATE.clear()
+        tap_braintree.STATE["transactions"] = "2018-01-30T00:00:00Z"
+        with mock.patch("tap_braintree.get_transactions_data", side_effect=search_daily):
+            tap_braintree.sync_transactions()
+
+        self.assertEqual(len(self.manifests()), 2)
+        day = os.path.join(self.tmp.name, "transactions", "date=2018-01-15")
+        self.assertEqual(len(os.listdir(day)), 2)
+
+    def test_finishes_days_as_windows_complete(self, mocked_now, mocked_write_record,
+                                               mocked_write_state):
+        """
+        Each completed window flushes and closes the days it finished, so
+        neither buffered rows nor open files pile up over a long sync
+        """
+        tap_braintree.CONFIG["export_batch_size"] = 100
+        open_after_window = []
+        finish_partitions = ParquetExporter.finish_partitions
+
+        def record_open(exporter, before):
+            finish_partitions(exporter, before)
+            open_after_window.append((len(exporter.buffers), len(exporter.writers)))
+
+        with mock.patch.object(ParquetExporter, "finish_partitions", record_open), \
+                mock.patch("tap_braintree.get_transactions_data", side_effect=search_daily):
+            tap_braintree.sync_transactions()
+
+        self.assertEqual(len(open_after_window), 33)
+        self.assertEqual(set(open_after_window[:-1]), {(0, 0)})
+        # The last window ends mid-day, that day is left for close()
+        self.assertEqual(open_after_window[-1], (1, 0))
+
+    def test_failed_sync_removes_partial_files(self, mocked_now, mocked_write_record,
+                                               mocked_write_state):
+        """
+        A failing export sync removes the files it wrote and writes neither a
+        manifest nor a state
+        """
+        tap_braintree.CONFIG["export_batch_size"] = 1
+
+        with mock.patch("tap_braintree.get_transactions_data",
+                        side_effect=failing_search(RuntimeError("search failed"))):
+            with self.assertRaises(RuntimeError):
+                tap_braintree.sync_transactions()
+
+        mocked_write_state.assert_not_called()
+        self.assertEqual(self.manifests(), [])
+        for _, _, files in os.walk(self.tmp.name):
+            self.assertEqual(files, [])
+
+
+@mock.patch("tap_braintree.braintree.Configuration.configure")
+@mock.patch("tap_braintree.utils.parse_args")
+class TestExportConfig(unittest.TestCase):
+
+    def test_invalid_batch_size(self, mocked_parse_args, mocked_configure):
+        """
+        Non-numeric, zero and negative export batch sizes are rejected
+        """
+        for value in ("many", 0, -1):
+            mocked_parse_args.return_value = make_args(
+                export_format="parquet", export_path="/tmp", export_batch_size=value)
+
+            with self.assertRaisesRegex(ValueError, "export_batch_size"):
+                tap_braintree.main()
+
+        mocked_configure.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,303 @@
+import base64
+import json
+import threading
+import unittest
+from datetime import datetime, date
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytz
+
+import tap_braintree
+from singer import metadata
+
+from tap_braintree import graphql
+from tap_braintree.discover import discover
+from tap_braintree.transform import transform_row
+
+from .helpers import make_args
+
+from braintree.exceptions.authentication_error import AuthenticationError
+
+
+NODES = [
+    {
+        "legacyId": "abc1",
+        "createdAt": "2018-01-02T10:00:00.000000Z",
+        "statusHistory": [{"timestamp": "2018-01-02T10:00:00.000000Z"},
+                          {"timestamp": "2018-01-03T08:30:00.000000Z"}],
+        "status": "SUBMITTED_FOR_SETTLEMENT",
+        "amount": {"value": "10.50", "currencyCode": "USD"},
+        "customer": {"legacyId": "cust1", "email": "a@example.com", "firstName": "Ann",
+                     "lastName": None, "company": None, "phoneNumber": None, "website": None},
+        "paymentMethodSnapshot": {"__typename": "CreditCardDetails", "brandCode": "VISA"},
+        "disbursementDetails": {"date": "2018-01-04", "success": True},
+    },
+    {
+        "legacyId": "abc2",
+        "createdAt": "2018-01-02T11:00:00.000000Z",
+        "statusHistory": [],
+        "status": "AUTHORIZED",
+        "amount": {"value": "3.00", "currencyCode": "USD"},
+        "customer": None,
+        "paymentMethodSnapshot": None,
+        "disbursementDetails": None,
+    },
+]
+
+# Refunds live in their own search, transaction searches never return them
+REFUND_NODES = [
+    {
+        "legacyId": "ref1",
+        "createdAt": "2018-01-02T12:00:00.000000Z",
+        "amount": {"value": "10.50", "currencyCode": "USD"},
+    },
+]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Answer transaction and refund searches one node per page, like the
+    GraphQL API
+    """
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append({"headers": dict(self.headers), "body": body})
+
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.end_headers()
+            return
+
+        search = "refunds" if "refunds(" in body["query"] else "transactions"
+        variables = body["variables"]
+        created_at = variables["input"]["createdAt"]
+        nodes = [node for node in (REFUND_NODES if search == "refunds" else NODES)
+                 if created_at["greaterThanOrEqualTo"] <= node["createdAt"]
+                 <= created_at["lessThanOrEqualTo"]]
+        index = int(variables["after"] or 0)
+        page = nodes[index:index + variables["first"]]
+        next_index = index + variables["first"]
+
+        response = {"data": {"search": {search: {
+            "pageInfo": {"hasNextPage": next_index < len(nodes), "endCursor": str(next_index)},
+            "edges": [{"node": node} for node in page],
+        }}}}
+        payload = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class GraphQLTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self.server.requests = []
+        self.server.status = 200
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:{}/graphql".format(self.server.server_port)
+        self.client = graphql.GraphQLClient(self.url, "public", "private", timeout=5, page_size=1)
+
+
+class TestGraphQLQuery(unittest.TestCase):
+
+    def test_query_selects_only_requested_fields(self):
+        """
+        The query asks for the selected properties and the ones the sync
+        needs for its bookmarks, nothing else
+        """
+        fields = graphql.get_fields(["id", "amount"])
+        query = graphql.build_transaction_query(fields)
+
+        self.assertEqual(fields, ["id", "created_at", "updated_at", "disbursement_details", "amount"])
+        self.assertIn("amount { value }", query)
+        self.assertIn("disbursementDetails { date success }", query)
+        self.assertNotIn("customer", query)
+        self.assertNotIn("paymentMethodSnapshot", query)
+
+    def test_unmapped_fields_are_omitted(self):
+        """
+        Selected properties the GraphQL API does not offer are dropped
+        """
+        with self.assertLogs(graphql.LOGGER, "WARNING") as logs:
+            self.assertNotIn("plan_id", graphql.get_fields(["id", "plan_id"]))
+        self.assertIn("plan_id", logs.output[0])
+
+    def test_no_selection_does_not_warn(self):
+        """
+        Without a catalog selection every available property is requested
+        and nothing is reported as omitted
+        """
+        with mock.patch.object(graphql.LOGGER, "warning") as mocked_warning:
+            fields = graphql.get_fields(None)
+
+        mocked_warning.assert_not_called()
+        self.assertEqual(sorted(fields), sorted(graphql.FIELDS))
+
+    def test_selected_fields_from_catalog(self):
+        """
+        Catalog selection drives the requested fields, a catalog without any
+        selection requests everything
+        """
+        catalog = discover()
+        self.assertIsNone(tap_braintree.get_selected_fields(catalog))
+
+        stream = catalog.get_stream("transactions")
+        mdata = metadata.to_map(stream.metadata)
+        mdata = metadata.write(mdata, ("properties", "amount"), "selected", True)
+        mdata = metadata.write(mdata, ("properties", "status"), "selected", False)
+        stream.metadata = metadata.to_list(mdata)
+
+        self.assertEqual(tap_braintree.get_selected_fields(catalog), ["id", "created_at", "amount"])
+
+
+class TestGraphQLClient(GraphQLTestCase):
+
+    def test_search_follows_cursors_and_maps_nodes(self):
+        """
+        Every page is fetched with the cursor of the previous one and nodes
+        are mapped onto the SDK's transaction attributes
+        """
+        fields = graphql.get_fields(None)
+        results = self.client.search_transactions(
+            datetime(2018, 1, 2, tzinfo=pytz.UTC), datetime(2018, 1, 3, tzinfo=pytz.UTC), fields)
+        rows = list(results)
+
+        self.assertEqual([request["body"]["variables"]["after"] for request in self.server.requests],
+                         [None, "1"])
+        headers = self.server.requests[0]["headers"]
+        self.assertEqual(headers["Authorization"],
+                         "Basic " + base64.b64encode(b"public:private").decode())
+        self.assertEqual(headers["Braintree-Version"], graphql.API_VERSION)
+
+        self.assertEqual(rows[0].id, "abc1")
+        self.assertEqual(rows[0].updated_at, datetime(2018, 1, 3, 8, 30, tzinfo=pytz.UTC))
+        self.assertEqual(rows[0].status, "submitted_for_settlement")
+        self.assertEqual(rows[0].amount, Decimal("10.50"))
+        self.assertEqual(rows[0].payment_instrument_type, "credit_card")
+        self.assertEqual(rows[0].disbursement_details.disbursement_date, date(2018, 1, 4))
+        self.assertIsNone(rows[1].updated_at)
+        self.assertIsNone(rows[1].disbursement_details.disbursement_date)
+
+        record = transform_row(rows[0], tap_braintree.load_schema("transactions"))
+        self.assertEqual(record["customer_details"]["email"], "a@example.com")
+        self.assertEqual(record["credit_card_details"]["card_type"], "Visa")
+        self.assertNotIn("plan_id", record)
+
+    def test_authentication_error(self):
+        """
+        A 401 is raised as the SDK's AuthenticationError without retrying
+        """
+        self.server.status = 401
+
+        with self.assertRaises(AuthenticationError):
+            self.client.execute("query { ping }", {})
+
+        self.assertEqual(len(self.server.requests), 1)
+
+
+@mock.patch("tap_braintree.singer.write_state")
+@mock.patch("tap_braintree.singer.write_record")
+@mock.patch("tap_braintree.utils.now", return_value=datetime(2018, 1, 3, 12, tzinfo=pytz.UTC))
+class TestGraphQLSync(GraphQLTestCase):
+
+    def setUp(self):
+        super().setUp()
+        tap_braintree.CONFIG.clear()
+        tap_braintree.STATE.clear()
+        tap_braintree.CONFIG.update({
+            "start_date": "2018-01-02T00:00:00Z",
+            "api_backend": "graphql",
+            "graphql_url": self.url,
+            "public_key": "public",
+            "private_key": "private",
+        })
+
+    def test_sync_uses_graphql_backend(self, mocked_now, mocked_write_record, mocked_write_state):
+        """
+        A GraphQL sync writes records and bookmarks through the same
+        transform as the SDK path
+        """
+        tap_braintree.sync_transactions(["id", "created_at", "amount"])
+
+        records = [call.args[1] for call in mocked_write_record.call_args_list]
+        self.assertEqual(records, [
+            {"id": "abc1", "created_at": "2018-01-02T10:00:00.000000Z",
+             "updated_at": "2018-01-03T08:30:00.000000Z", "amount": 10.5,
+             "disbursement_details": {"disbursement_date": "2018-01-04T00:00:00.000000Z",
+                                      "success": True}},
+            {"id": "abc2", "created_at": "2018-01-02T11:00:00.000000Z",
+             "updated_at": "2018-01-02T11:00:00.000000Z", "amount": 3.0,
+             "disbursement_details": {"disbursement_date": None,
+                                      "success": None}},
+        ])
+        self.assertEqual(tap_braintree.STATE["latest_updated_at"], "2018-01-03T08:30:00.000000Z")
+        self.assertEqual(tap_braintree.STATE["transactions"], "2018-01-03T12:00:00.000000Z")
+
+    def test_sync_drops_refunds(self, mocked_now, mocked_write_record, mocked_write_state):
+        """
+        Refunds are not searched, so credits are missing from a GraphQL
+        sync, and the sync says so
+        """
+        with self.assertLogs(tap_braintree.logger, "WARNING") as logs:
+            tap_braintree.sync_transactions(["id", "created_at"])
+
+        self.assertTrue(any("refunds" in line for line in logs.output))
+        self.assertEqual([call.args[1]["id"] for call in mocked_write_record.call_args_list],
+                         ["abc1", "abc2"])
+        self.assertTrue(all("transactions(" in request["body"]["query"]
+                            and "refunds(" not in request["body"]["query"]
+                            for request in self.server.requests))
+
+
+@mock.patch("tap_braintree.braintree.Configuration.configure")
+@mock.patch("tap_braintree.utils.parse_args")
+class TestGraphQLConfig(unittest.TestCase):
+
+    def setUp(self):
+        tap_braintree.CONFIG.clear()
+
+    def test_invalid_page_size(self, mocked_parse_args, mocked_configure):
+        """
+        Page sizes must be integers the API accepts
+        """
+        for value in ("many", 0, -1, graphql.MAX_PAGE_SIZE + 1):
+            mocked_parse_args.return_value = make_args(api_backend="graphql",
+                                                       graphql_page_size=value)
+
+            with self.assertRaisesRegex(ValueError, "graphql_page_size"):
+                tap_braintree.main()
+
+        mocked_configure.assert_not_called()
+
+    def test_environment_without_url(self, mocked_parse_args, mocked_configure):
+        """
+        An environment without a known GraphQL endpoint needs graphql_url
+        """
+        mocked_parse_args.return_value = make_args(api_backend="graphql", environment="Development")
+
+        with self.assertRaisesRegex(ValueError, "graphql_url"):
+            tap_braintree.main()
+        mocked_configure.assert_not_called()
+
+        mocked_parse_args.return_value = make_args(api_backend="graphql", environment="Development",
+                                                   graphql_url="http://localhost/graphql")
+        tap_braintree.main()
+
+        self.assertEqual(tap_braintree.CONFIG["graphql_url"], "http://localhost/graphql")
+        self.assertEqual(tap_braintree.get_graphql_client().url, "http://localhost/graphql")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import pytz
+
+import tap_braintree
+
+from .helpers import search_daily
+
+
+NOW = datetime(2018, 2, 1, 12, tzinfo=pytz.UTC)
+
+
+class FakeClock:
+    """
+    Monotonic clock where every search takes `search_seconds`, or the next
+    of a list of durations
+    """
+
+    def __init__(self, search_seconds):
+        self.now = 0
+        self.search_seconds = search_seconds
+        self.searches = []
+
+    def monotonic(self):
+        return self.now
+
+    def search(self, start, end):
+        if isinstance(self.search_seconds, list):
+            self.now += self.search_seconds[len(self.searches)]
+        else:
+            self.now += self.search_seconds
+        self.searches.append(start)
+        return search_daily(start, end)
+
+
+@mock.patch("tap_braintree.singer.write_state")
+@mock.patch("tap_braintree.singer.write_record")
+@mock.patch("tap_braintree.utils.now", return_value=NOW)
+class TestMaxRunSeconds(unittest.TestCase):
+
+    def setUp(self):
+        tap_braintree.CONFIG.clear()
+        tap_braintree.STATE.clear()
+        tap_braintree.CONFIG["start_date"] = "2018-01-25T00:00:00Z"
+        tap_braintree.STATE["transactions"] = "2018-01-25T00:00:00Z"
+
+    def sync(self, clock):
+        with mock.patch("tap_braintree.time.monotonic", clock.monotonic), \
+                mock.patch("tap_braintree.get_transactions_data", clock.search):
+            tap_braintree.sync_transactions()
+
+    def test_stops_before_window_that_would_overrun(self, mocked_now, mocked_write_record,
+                                                    mocked_write_state):
+        """
+        With 10s windows and a 25s budget, two windows are synced and the
+        third is left for the next run without moving the bookmarks
+        """
+        tap_braintree.CONFIG["max_run_seconds"] = 25
+        clock = FakeClock(10)
+
+        self.sync(clock)
+
+        self.assertEqual(len(clock.searches), 2)
+        self.assertEqual(mocked_write_record.call_count, 2)
+        self.assertEqual(tap_braintree.STATE, {
+            "transactions": "2018-01-25T00:00:00Z",
+            "transactions_resume": {
+                "window_start": "2017-12-28T00:00:00.000000Z",
+                "max_updated_at": "2017-12-27T10:00:00.000000Z",
+                "max_disbursement_date": "2018-01-01T00:00:00.000000Z",
+            },
+        })
+        mocked_write_state.assert_called_once_with(tap_braintree.STATE)
+
+    def test_abandons_window_past_deadline(self, mocked_now, mocked_write_record,
+                                           mocked_write_state):
+        """
+        A window still running when the deadline passes is abandoned and
+        resumed from its start on the next run
+        """
+        tap_braintree.CONFIG["max_run_seconds"] = 5
+        clock = FakeClock([1, 10])
+
+        self.sync(clock)
+
+        self.assertEqual(len(clock.searches), 2)
+        self.assertEqual(mocked_write_record.call_count, 1)
+        self.assertEqual(tap_braintree.STATE["transactions_resume"]["window_start"],
+                         "2017-12-27T00:00:00.000000Z")
+
+    def test_window_longer_than_budget_progresses(self, mocked_now, mocked_write_record,
+                                                  mocked_write_state):
+        """
+        The first window of a run always finishes, so windows longer than
+        the whole budget still move the resume point forward run after run
+        """
+        tap_braintree.CONFIG["max_run_seconds"] = 5
+
+        window_starts = []
+        for _ in range(3):
+            self.sync(FakeClock(10))
+            window_starts.append(tap_braintree.STATE["transactions_resume"]["window_start"])
+
+        self.assertEqual(window_starts, ["2017-12-27T00:00:00.000000Z",
+                                         "2017-12-28T00:00:00.000000Z",
+                                         "2017-12-29T00:00:00.000000Z"])
+        self.assertEqual(mocked_write_record.call_count, 3)
+
+    def test_resumes_and_completes(self, mocked_now, mocked_write_record,
+                                   mocked_write_state):
+        """
+        A resumed run starts at the stored window, without the trailing
+        days, and moves the bookmarks once the whole range is synced
+        """
+        tap_braintree.STATE["transactions_resume"] = {
+            "window_start": "2018-01-30T00:00:00.000000Z",
+            "max_updated_at": "2018-02-05T00:00:00.000000Z",
+            "max_disbursement_date": "2018-01-01T00:00:00.000000Z",
+        }
+        clock = FakeClock(10)
+
+        self.sync(clock)
+
+        self.assertEqual(clock.searches[0], datetime(2018, 1, 30, tzinfo=pytz.UTC))
+        self.assertEqual(len(clock.searches), 3)
+        self.assertNotIn("transactions_resume", tap_braintree.STATE)
+        self.assertEqual(tap_braintree.STATE["latest_updated_at"], "2018-02-05T00:00:00.000000Z")
+        self.assertEqual(tap_braintree.STATE["transactions"], "2018-02-01T12:00:00.000000Z")
+
+
+if __name__ == '__main__':
+    unittest.main()
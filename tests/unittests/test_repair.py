@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import tap_braintree
+
+from .helpers import make_args
+
+
+def search_by_ids(query):
+    """Return a transaction for every requested ID except "missing"."""
+    return [SimpleNamespace(id=transaction_id, created_at=datetime(2018, 1, 1),
+                            updated_at=None, disbursement_details=None)
+            for transaction_id in query.to_param() if transaction_id != "missing"]
+
+
+@mock.patch("tap_braintree.singer.write_state")
+@mock.patch("tap_braintree.singer.write_record")
+@mock.patch("tap_braintree.braintree.Transaction.search", side_effect=search_by_ids)
+class TestRepairSync(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.ids_path = os.path.join(self.tmp.name, "ids.txt")
+        with open(self.ids_path, "w") as ids_file:
+            ids_file.write("a\nb\n\nc\na\nmissing\nd\ne\n")
+
+        tap_braintree.CONFIG.clear()
+        tap_braintree.STATE.clear()
+        tap_braintree.CONFIG.update({
+            "start_date": "2018-01-01T00:00:00Z",
+            "repair_ids_path": self.ids_path,
+            "repair_batch_size": 2,
+        })
+        tap_braintree.STATE["transactions"] = "2018-01-01T00:00:00Z"
+
+    def test_read_transaction_ids(self, mocked_search, mocked_write_record, mocked_write_state):
+        """
+        Blank lines and duplicate IDs are dropped, file order is kept
+        """
+        self.assertEqual(tap_braintree.read_transaction_ids(self.ids_path),
+                         ["a", "b", "c", "missing", "d", "e"])
+
+    def test_repair_emits_records_without_state(self, mocked_search, mocked_write_record,
+                                                mocked_write_state):
+        """
+        IDs are searched in batches, every transaction found is transformed
+        and written once, and bookmarks are left untouched
+        """
+        tap_braintree.do_sync()
+
+        self.assertEqual(
+            sorted(call.args[0].to_param() for call in mocked_search.call_args_list),
+            [["a", "b"], ["c", "missing"], ["d", "e"]]
+        )
+        records = [call.args[1] for call in mocked_write_record.call_args_list]
+        self.assertEqual(sorted(record["id"] for record in records), ["a", "b", "c", "d", "e"])
+        self.assertEqual(records[0]["updated_at"], "2018-01-01T00:00:00.000000Z")
+        mocked_write_state.assert_not_called()
+        self.assertEqual(tap_braintree.STATE, {"transactions": "2018-01-01T00:00:00Z"})
+
+
+@mock.patch("tap_braintree.braintree.Configuration.configure")
+@mock.patch("tap_braintree.utils.parse_args")
+class TestRepairConfig(unittest.TestCase):
+
+    def setUp(self):
+        tap_braintree.CONFIG.clear()
+
+    def test_invalid_batch_options(self, mocked_parse_args, mocked_configure):
+        """
+        Non-numeric, zero and negative batch sizes and concurrencies are rejected
+        """
+        for key in ("repair_batch_size", "repair_concurrency"):
+            for value in ("many", 0, -1):
+                mocked_parse_args.return_value = make_args(**{key: value})
+
+                with self.assertRaisesRegex(ValueError, key):
+                    tap_braintree.main()
+
+        mocked_configure.assert_not_called()
+
+    def test_unsupported_options(self, mocked_parse_args, mocked_configure):
+        """
+        Options the repair sync would ignore are rejected instead
+        """
+        for option, message in (({"export_format": "parquet", "export_path": "/tmp"},
+                                 "export_format"),
+                                ({"max_run_seconds": 60}, "max_run_seconds"),
+                                ({"api_backend": "graphql"}, "api_backend")):
+            mocked_parse_args.return_value = make_args(repair_ids_path="ids.txt", **option)
+
+            with self.assertRaisesRegex(ValueError, message):
+                tap_braintree.main()
+
+        mocked_configure.assert_not_called()
+
+    def test_defaults(self, mocked_parse_args, mocked_configure):
+        """
+        Batch size and concurrency fall back to their defaults
+        """
+        mocked_parse_args.return_value = make_args(repair_ids_path="ids.txt")
+
+        tap_braintree.main()
+
+        self.assertEqual(tap_braintree.CONFIG["repair_ids_path"], "ids.txt")
+        self.assertEqual(tap_braintree.CONFIG["repair_batch_size"], tap_braintree.REPAIR_BATCH_SIZE)
+        self.assertEqual(tap_braintree.CONFIG["repair_concurrency"],
+                         tap_braintree.REPAIR_CONCURRENCY)
+
+
+if __name__ == '__main__':
+    unittest.main()
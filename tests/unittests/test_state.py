@@ -0,0 +1,188 @@
+import copy
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import pytz
+
+import tap_braintree
+from tap_braintree.state import StateEmitter
+
+from .helpers import failing_search, make_args, search_daily
+
+
+NOW = datetime(2018, 2, 1, 12, tzinfo=pytz.UTC)
+
+
+class TestStateEmitter(unittest.TestCase):
+
+    def setUp(self):
+        self.checkpoint = mock.Mock()
+        patcher = mock.patch("tap_braintree.state.singer.write_state")
+        self.mocked_write_state = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled_writes_nothing_until_asked(self):
+        """
+        Without a policy only explicit writes emit a STATE message
+        """
+        emitter = StateEmitter({}, self.checkpoint)
+        for _ in range(10):
+            emitter.record_written()
+        emitter.window_completed()
+
+        self.mocked_write_state.assert_not_called()
+        emitter.write()
+        self.assertEqual(self.mocked_write_state.call_count, 1)
+        self.checkpoint.assert_not_called()
+
+    def test_every_records(self):
+        """
+        Bookmarks are checkpointed and written once per `every_records` records
+        """
+        emitter = StateEmitter({}, self.checkpoint, every_records=3)
+        for _ in range(7):
+            emitter.record_written()
+
+        self.assertEqual(self.mocked_write_state.call_count, 2)
+        self.assertEqual(self.checkpoint.call_count, 2)
+
+    @mock.patch("tap_braintree.state.time.monotonic")
+    def test_every_seconds(self, mocked_monotonic):
+        """
+        A state is written on the first record or window end at least
+        `every_seconds` after the previous one
+        """
+        mocked_monotonic.return_value = 0
+        emitter = StateEmitter({}, self.checkpoint, every_seconds=30)
+
+        mocked_monotonic.return_value = 29
+        emitter.record_written()
+        self.mocked_write_state.assert_not_called()
+
+        mocked_monotonic.return_value = 30
+        emitter.window_completed()
+        mocked_monotonic.return_value = 45
+        emitter.record_written()
+
+        self.assertEqual(self.mocked_write_state.call_count, 1)
+
+
+@mock.patch("tap_braintree.singer.write_record")
+@mock.patch("tap_braintree.utils.now", return_value=NOW)
+class TestSyncStateEmission(unittest.TestCase):
+
+    def setUp(self):
+        tap_braintree.CONFIG.clear()
+        tap_braintree.STATE.clear()
+        tap_braintree.CONFIG["start_date"] = "2018-01-30T00:00:00Z"
+        tap_braintree.STATE["transactions"] = "2018-01-30T00:00:00Z"
+
+        self.states = []
+        patcher = mock.patch("tap_braintree.state.singer.write_state",
+                             side_effect=lambda state: self.states.append(copy.deepcopy(state)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_window_boundaries(self, mocked_now, mocked_write_record):
+        """
+        With state_emit_on_window a resumable state follows every window and
+        the final state holds the exact bookmarks
+        """
+        tap_braintree.CONFIG["state_emit_on_window"] = True
+
+        with mock.patch("tap_braintree.get_transactions_data", side_effect=search_daily):
+            tap_braintree.sync_transactions()
+
+        self.assertEqual(len(self.states), 34)
+        self.assertEqual(self.states[0]["transactions_resume"], {
+            "window_start": "2018-01-01T00:00:00.000000Z",
+            "max_updated_at": "2017-12-31T10:00:00.000000Z",
+            "max_disbursement_date": "2018-01-01T00:00:00.000000Z",
+        })
+        self.assertNotIn("transactions_resume", self.states[-1])
+        self.assertEqual(self.states[-1]["latest_updated_at"], "2018-02-01T10:00:00.000000Z")
+        self.assertEqual(self.states[-1]["transactions"], "2018-02-01T12:00:00.000000Z")
+
+    def test_every_records_coalesces(self, mocked_now, mocked_write_record):
+        """
+        Intermediate bookmarks are only written every N records
+        """
+        tap_braintree.CONFIG["state_emit_every_records"] = 10
+
+        with mock.patch("tap_braintree.get_transactions_data", side_effect=search_daily):
+            tap_braintree.sync_transactions()
+
+        self.assertEqual(mocked_write_record.call_count, 33)
+        self.assertEqual(len(self.states), 4)
+        self.assertEqual(self.states[0]["transactions_resume"]["window_start"],
+                         "2018-01-09T00:00:00.000000Z")
+
+    def test_error_writes_resumable_state(self, mocked_now, mocked_write_record):
+        """
+        An error leaves a state resuming from the window that failed
+        """
+        with mock.patch("tap_braintree.get_transactions_data",
+                        side_effect=failing_search(RuntimeError("search failed"))):
+            with self.assertRaises(RuntimeError):
+                tap_braintree.sync_transactions()
+
+        self.assertEqual(len(self.states), 1)
+        self.assertEqual(self.states[0]["transactions_resume"]["window_start"],
+                         "2018-01-05T00:00:00.000000Z")
+        self.assertEqual(self.states[0]["transactions"], "2018-01-30T00:00:00Z")
+
+    def test_interrupt_writes_resumable_state(self, mocked_now, mocked_write_record):
+        """
+        An interrupted sync also leaves a resumable state behind
+        """
+        with mock.patch("tap_braintree.get_transactions_data",
+                        side_effect=failing_search(KeyboardInterrupt())):
+            with self.assertRaises(KeyboardInterrupt):
+                tap_braintree.sync_transactions()
+
+        self.assertEqual(len(self.states), 1)
+        self.assertEqual(self.states[0]["transactions_resume"]["window_start"],
+                         "2018-01-05T00:00:00.000000Z")
+
+
+@mock.patch("tap_braintree.braintree.Configuration.configure")
+@mock.patch("tap_braintree.utils.parse_args")
+class TestStateEmitConfig(unittest.TestCase):
+
+    def setUp(self):
+        tap_braintree.CONFIG.clear()
+
+    def test_options_are_parsed(self, mocked_parse_args, mocked_configure):
+        """
+        Options given as strings are stored with their types
+        """
+        mocked_parse_args.return_value = make_args(state_emit_every_records="100",
+                                                         state_emit_every_seconds="1.5",
+                                                         state_emit_on_window="True")
+
+        tap_braintree.main()
+
+        self.assertEqual(tap_braintree.CONFIG["state_emit_every_records"], 100)
+        self.assertEqual(tap_braintree.CONFIG["state_emit_every_seconds"], 1.5)
+        self.assertIs(tap_braintree.CONFIG["state_emit_on_window"], True)
+
+    def test_invalid_options(self, mocked_parse_args, mocked_configure):
+        """
+        Non-numeric and negative intervals and non-boolean flags are rejected
+        """
+        for key, value in (("state_emit_every_records", "often"),
+                           ("state_emit_every_records", -1),
+                           ("state_emit_every_seconds", "soon"),
+                           ("state_emit_every_seconds", -0.5),
+                           ("state_emit_on_window", "yes")):
+            mocked_parse_args.return_value = make_args(**{key: value})
+
+            with self.assertRaisesRegex(ValueError, key):
+                tap_braintree.main()
+
+        mocked_configure.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,8 @@ import unittest
 import tap_braintree
 import pytz
 
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
+from types import SimpleNamespace
 
 
 class TestDateRangeUtility(unittest.TestCase):
@@ -62,6 +63,52 @@ class TestDateRangeUtility(unittest.TestCase):
         )
 
 
+class TestGetDisbursementDate(unittest.TestCase):
+
+    def test_no_disbursement_details(self):
+        """
+        Transactions without disbursement details fall back to datetime.min
+        in UTC, so they compare with the stored bookmark
+        """
+        row = SimpleNamespace(disbursement_details=None)
+
+        self.assertEqual(tap_braintree.get_disbursement_date(row),
+                         datetime.min.replace(tzinfo=pytz.UTC))
+
+    def test_disbursement_date_set(self):
+        """
+        The disbursement date is returned as 0:00 UTC on that day
+        """
+        row = SimpleNamespace(disbursement_details=SimpleNamespace(
+            disbursement_date=date(2018, 1, 5)))
+
+        self.assertEqual(
+            tap_braintree.get_disbursement_date(row),
+            datetime(2018, 1, 5, 0, 0, tzinfo=pytz.UTC)
+        )
+
+
+class TestWatermarks(unittest.TestCase):
+
+    def test_update(self):
+        """
+        Transactions updated or disbursed since the stored bookmarks are
+        written and raise this run's high water marks, older ones are skipped
+        """
+        latest = datetime(2018, 1, 10, tzinfo=pytz.UTC)
+        watermarks = tap_braintree.Watermarks(latest, latest)
+
+        self.assertFalse(watermarks.update(datetime(2018, 1, 9, tzinfo=pytz.UTC),
+                                           datetime.min.replace(tzinfo=pytz.UTC)))
+        self.assertTrue(watermarks.update(datetime(2018, 1, 9, tzinfo=pytz.UTC),
+                                          datetime(2018, 1, 11, tzinfo=pytz.UTC)))
+        self.assertTrue(watermarks.update(datetime(2018, 1, 12, tzinfo=pytz.UTC),
+                                          datetime(2018, 1, 10, tzinfo=pytz.UTC)))
+
+        self.assertEqual(watermarks.max_updated_at, datetime(2018, 1, 12, tzinfo=pytz.UTC))
+        self.assertEqual(watermarks.max_disbursement_date, datetime(2018, 1, 11, tzinfo=pytz.UTC))
+
+
 if __name__ == '__main__':
     unittest.main()
 
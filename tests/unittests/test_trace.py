@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import tap_braintree
+from tap_braintree.trace import Tracer, TRACER
+
+from .helpers import Results, make_args, make_transaction
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "trace.json")
+
+    def test_disabled_records_nothing(self):
+        """
+        Without a path the tracer is a no-op and writes no file
+        """
+        tracer = Tracer()
+        with tracer.span("sync"):
+            tracer.instant("retry")
+
+        self.assertEqual(list(tracer.iterate_pages([1, 2])), [1, 2])
+        self.assertFalse(tracer.sample_transform())
+        tracer.save()
+
+        self.assertEqual(tracer.events, [])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_writes_chrome_trace_events(self):
+        """
+        Spans are saved as complete events, instants as instant events and
+        slow waits on the results iterator as page fetches
+        """
+        tracer = Tracer()
+        tracer.configure(self.path, transform_every=2)
+
+        def slow_results():
+            time.sleep(0.01)
+            yield "a"
+            yield "b"
+
+        with tracer.span("window", start="2018-01-01"):
+            tracer.instant("retry", cat="api", tries=1)
+            self.assertEqual(list(tracer.iterate_pages(slow_results())), ["a", "b"])
+
+        self.assertEqual([tracer.sample_transform() for _ in range(4)],
+                         [False, True, False, True])
+        tracer.save()
+
+        with open(self.path) as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+
+        self.assertEqual([(e["name"], e["ph"]) for e in events],
+                         [("retry", "i"), ("fetch_page", "X"), ("window", "X")])
+        self.assertEqual(events[2]["args"], {"start": "2018-01-01"})
+        self.assertGreaterEqual(events[1]["dur"], 10000)
+
+
+@mock.patch("tap_braintree.singer.write_state")
+@mock.patch("tap_braintree.singer.write_record")
+@mock.patch("tap_braintree.braintree.Transaction.search")
+class TestSyncTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "trace.json")
+        TRACER.configure(self.path, transform_every=1)
+        self.addCleanup(TRACER.configure, None)
+        tap_braintree.CONFIG.clear()
+        tap_braintree.STATE.clear()
+        tap_braintree.CONFIG["start_date"] = "2018-01-01T00:00:00Z"
+
+    @mock.patch("tap_braintree.utils.now", return_value=tap_braintree.to_utc(datetime(2018, 1, 2, 12)))
+    def test_sync_records_timeline(self, mocked_now, mocked_search, mocked_write_record,
+                                   mocked_write_state):
+        """
+        A traced sync records the sync, each window, searches, sampled
+        transforms and the state write
+        """
+        mocked_search.side_effect = lambda *args: Results(
+            [make_transaction("1", datetime(2018, 1, 2, 10))])
+
+        tap_braintree.do_sync()
+
+        with open(self.path) as trace_file:
+            names = [e["name"] for e in json.load(trace_file)["traceEvents"]]
+
+        self.assertEqual(names.count("window"), 32)
+        self.assertEqual(names.count("search"), 32)
+        self.assertEqual(names.count("transform_row"), 32)
+        self.assertEqual(names[-2:], ["write_state", "sync_transactions"])
+        self.assertEqual(mocked_write_record.call_count, 32)
+
+
+@mock.patch("tap_braintree.braintree.Configuration.configure")
+@mock.patch("tap_braintree.utils.parse_args")
+class TestTraceConfig(unittest.TestCase):
+
+    def test_invalid_transform_every(self, mocked_parse_args, mocked_configure):
+        """
+        Non-numeric and negative trace_transform_every values are rejected
+        """
+        for value in ("often", -1):
+            mocked_parse_args.return_value = make_args(trace_transform_every=value)
+
+            with self.assertRaisesRegex(ValueError, "trace_transform_every"):
+                tap_braintree.main()
+
+        mocked_configure.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()